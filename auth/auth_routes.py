@@ -1,33 +1,36 @@
+import os
+import anyio
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import get_db
 from auth.crud_user import get_user, create_user, authenticate_user
 from auth.auth_utils import create_access_token, decode_access_token
 from models import RoleEnum
 from schemas import UserRegister, UserOut, Token, UserLogin
-from jose import JWTError
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# bcrypt es CPU-bound: se ejecuta en threads propios, limitados a la cantidad de núcleos,
+# para que un pico de logins no agote el threadpool que usan los demás endpoints.
+_BCRYPT_LIMITER = anyio.CapacityLimiter(os.cpu_count() or 1)
 
 @router.post("/register", response_model=UserOut, status_code=status.HTTP_201_CREATED)
-def register_user(user: UserRegister, db: Session = Depends(get_db)):
-    existing_user = get_user(db, user.username)
+async def register_user(user: UserRegister, db: Session = Depends(get_db)):
+    existing_user = await anyio.to_thread.run_sync(get_user, db, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="El nombre de usuario ya existe")
-    from models import RoleEnum
-    new_user = create_user(db, user.username, user.userpassword, RoleEnum.user)
+    new_user = await anyio.to_thread.run_sync(
+        create_user, db, user.username, user.userpassword, RoleEnum.user,
+        limiter=_BCRYPT_LIMITER
+    )
     return new_user
 
 @router.post("/login", response_model=Token)
-def login_user(user: UserLogin, db: Session = Depends(get_db)):
-    user_db = authenticate_user(db, user.username, user.userpassword)
+async def login_user(user: UserLogin, db: Session = Depends(get_db)):
+    user_db = await anyio.to_thread.run_sync(
+        authenticate_user, db, user.username, user.userpassword,
+        limiter=_BCRYPT_LIMITER
+    )
     if not user_db:
         raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
     
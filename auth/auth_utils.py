@@ -1,93 +1,124 @@
 import bcrypt
-from jose import JWTError, jwt
+import jwt
+import hashlib
+import hmac
 from datetime import datetime, timedelta, timezone
 import os
-from dotenv import load_dotenv
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import Row, bindparam, select
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import get_db
 from models import User, RoleEnum
+from utils.cache import TTLCache
+from auth.config import SECRET_KEY_BYTES, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, BCRYPT_COST
 
-load_dotenv()
-
-SECRET_KEY = os.getenv("SECRET_JWT")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", 120))
-
-if not SECRET_KEY:
-    raise ValueError("SECRET_JWT no está configurada en las variables de entorno")
+# Límite de bcrypt: solo se usan los primeros 72 bytes de la contraseña
+_BCRYPT_MAX_BYTES = 72
 
 # Funciones de hashing de contraseñas usando bcrypt directamente
 def hash_password(password: str) -> str:
-    # Encode la contraseña como bytes, genera el salt y hashea
-    password_bytes = password.encode('utf-8')
-    # Truncar la contraseña a 72 bytes (límite de bcrypt)
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    salt = bcrypt.gensalt()
+    # Encode la contraseña como bytes (truncada al límite de bcrypt), genera el salt y hashea
+    password_bytes = password.encode('utf-8')[:_BCRYPT_MAX_BYTES]
+    salt = bcrypt.gensalt(BCRYPT_COST)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    # Encode ambos como bytes y verifica
-    password_bytes = plain_password.encode('utf-8')
-    # Truncar la contraseña a 72 bytes (límite de bcrypt)
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
+    # Encode ambos como bytes (contraseña truncada al límite de bcrypt) y verifica
+    password_bytes = plain_password.encode('utf-8')[:_BCRYPT_MAX_BYTES]
     hashed_bytes = hashed_password.encode('utf-8')
     try:
         return bcrypt.checkpw(password_bytes, hashed_bytes)
     except ValueError:
         return False
 
+# Logins verificados recientemente: un mismo cliente que repite el login (refresh de la SPA)
+# no vuelve a pagar bcrypt. La clave es un MAC con secreto aleatorio por proceso, nunca la contraseña.
+_login_cache = TTLCache(maxsize=1024, ttl=30)
+_LOGIN_CACHE_KEY = os.urandom(32)
+
+def verify_password_cached(username: str, plain_password: str, hashed_password: str) -> bool:
+    cache_key = hashlib.blake2b(
+        f"{username}\0{plain_password}".encode('utf-8'), key=_LOGIN_CACHE_KEY, digest_size=16
+    ).digest()
+    cached_hash = _login_cache.get(cache_key)
+    # Si la contraseña cambió, el hash guardado ya no coincide con el de la base
+    if cached_hash is not None and hmac.compare_digest(cached_hash, hashed_password):
+        return True
+    if not verify_password(plain_password, hashed_password):
+        return False
+    _login_cache.set(cache_key, hashed_password)
+    return True
+
+_dummy_hash = None
+
+def verify_dummy_password(plain_password: str) -> None:
+    """Ejecuta un bcrypt descartable para que un usuario inexistente tarde lo mismo que uno real."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password("dummy-password")
+    verify_password(plain_password, _dummy_hash)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, SECRET_KEY_BYTES, algorithm=ALGORITHM)
+
+# Caché de tokens ya verificados: evita repetir la verificación HMAC en cada request.
+# Cada entrada vence junto con el "exp" del token (o antes, por el TTL de la caché).
+_token_cache = TTLCache(maxsize=4096, ttl=60)
 
 def decode_access_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    payload = _token_cache.get(token)
+    if payload is not None:
         return payload
-    except JWTError:
+    try:
+        payload = jwt.decode(token, SECRET_KEY_BYTES, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
         return None
+    _token_cache.set(token, payload, expires_at=payload.get("exp"))
+    return payload
+
+# Columnas del usuario que necesitan las dependencias de autenticación. La consulta corre en
+# cada request autenticado: se arma una sola vez y solo cambia el parámetro.
+# Las dependencias devuelven esa fila (Row con id, username y role), no la entidad User
+_CURRENT_USER_STMT = select(User.id, User.username, User.role).where(User.username == bindparam("username"))
 
 # Punto central del OAuth2 estándar: los tokens deben ir en header Authorization: Bearer ...
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+# Variante que no exige el header, para las dependencias opcionales
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
-def get_db_dep():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# Dependencia: obtiene el usuario autenticado (levanta error si token es inválido o no hay user)
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db_dep)) -> User:
+# Dependencias: token -> payload. FastAPI las resuelve una sola vez por request,
+# aunque varias dependencias de usuario (user, admin, opcional) las declaren.
+def get_token_payload(token: str = Depends(oauth2_scheme)) -> dict:
     payload = decode_access_token(token)
     if not payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido o expirado")
-    username = payload.get("sub")
-    user = db.query(User).filter(User.username == username).first()
+    return payload
+
+def get_token_payload_optional(token: str | None = Depends(oauth2_scheme_optional)) -> dict | None:
+    if not token:
+        return None
+    return decode_access_token(token)
+
+# Dependencia: obtiene el usuario autenticado (levanta error si token es inválido o no hay user)
+def get_current_user(payload: dict = Depends(get_token_payload), db: Session = Depends(get_db)) -> Row:
+    user = db.execute(_CURRENT_USER_STMT, {"username": payload.get("sub")}).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado")
     return user
 
 # Dependencia: retorna user si autenticado, o None si no lo está (para casos opcionales, rara vez se usa para este proyecto pero queda listo)
-def get_current_user_optional(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db_dep)) -> User | None:
-    if not token:
-        return None
-    payload = decode_access_token(token)
+def get_current_user_optional(payload: dict | None = Depends(get_token_payload_optional), db: Session = Depends(get_db)) -> Row | None:
     if not payload:
         return None
-    username = payload.get("sub")
-    user = db.query(User).filter(User.username == username).first()
-    return user
+    return db.execute(_CURRENT_USER_STMT, {"username": payload.get("sub")}).first()
 
 # Dependencia: SOLO deja pasar a usuarios administrador, y da error 403 si no lo es
-def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+def get_admin_user(current_user: Row = Depends(get_current_user)) -> Row:
     if current_user.role != RoleEnum.admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,17 @@
+import os
+from dotenv import load_dotenv
+
+# Configuración de autenticación: se lee del entorno una sola vez al importar
+load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_JWT")
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", 120))
+# Factor de costo de bcrypt (2^BCRYPT_COST rondas). Cada punto menos reduce a la mitad el tiempo de login.
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", 12))
+
+if not SECRET_KEY:
+    raise ValueError("SECRET_JWT no está configurada en las variables de entorno")
+
+# La clave HMAC se codifica una sola vez; PyJWT la usa tal cual en cada firma/verificación
+SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8")
\ No newline at end of file
@@ -1,9 +1,18 @@
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 from models import User
-from auth.auth_utils import hash_password, verify_password
+from auth.auth_utils import hash_password, verify_password_cached, verify_dummy_password
+
+# Consultas por nombre de usuario, armadas una sola vez con parámetros.
+# Datos públicos (los de UserOut, sin la contraseña) para los chequeos de existencia y /auth/me
+_USUARIO_POR_NOMBRE = select(User.id, User.username, User.role).where(User.username == bindparam("username"))
+# Columnas necesarias para verificar y emitir el token (sin hidratar la entidad)
+_CREDENCIALES_POR_NOMBRE = select(User.id, User.username, User.userpassword, User.role).where(
+  User.username == bindparam("username")
+)
 
 def get_user(db: Session, username: str):
-  return db.query(User).filter(User.username == username).first()
+  return db.execute(_USUARIO_POR_NOMBRE, {"username": username}).first()
 
 def create_user(db: Session, username: str, password: str, role):
   hashed_password = hash_password(password)
@@ -14,7 +23,11 @@ def create_user(db: Session, username: str, password: str, role):
   return db_user
 
 def authenticate_user(db: Session, username: str, password: str):
-  user = get_user(db, username)
-  if not user or not verify_password(password, user.userpassword):
+  user = db.execute(_CREDENCIALES_POR_NOMBRE, {"username": username}).first()
+  if not user:
+    # Mismo costo que un login real: no se filtra por tiempo qué usuarios existen
+    verify_dummy_password(password)
+    return None
+  if not verify_password_cached(username, password, user.userpassword):
     return None
   return user
\ No newline at end of file
@@ -1,6 +1,9 @@
+import logging
 import os
-from sqlalchemy import create_engine, engine
+from sqlalchemy import create_engine, engine, event, func, inspect, select
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from sqlalchemy.ext.declarative import declarative_base
 
 # SQLite URL de la base de datos local
@@ -12,15 +15,114 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", LOCAL_DATABASE_URL)
 # Verificar si estamos en producción (PostgreSQL) o en desarrollo (SQLite)
 IS_PRODUCTION = SQLALCHEMY_DATABASE_URL.startswith("postgresql://")
 
+# Tamaño del pool de PostgreSQL. MAX_CONEXIONES acota también los threads que esperan una conexión
+# (ver lifespan en main.py): más threads que conexiones solo terminan en timeouts del pool.
+# Queda en None cuando no hay un pool local con ese tamaño (SQLite, o PgBouncer con NullPool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 40))
+MAX_CONEXIONES = None
+
 # Configurar el motor de la base de datos
 engine = None
-if IS_PRODUCTION:
-  # Configuración para PostgreSQL
-  engine = create_engine(SQLALCHEMY_DATABASE_URL)
+if IS_PRODUCTION and os.getenv("DB_EXTERNAL_POOL") == "1":
+  # Detrás de PgBouncer (transaction pooling) el pool lo maneja él: sin pool local,
+  # cada sesión abre y cierra su conexión contra PgBouncer
+  engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+elif IS_PRODUCTION:
+  # Configuración para PostgreSQL: pool dimensionado para la concurrencia esperada,
+  # timeout acota la espera por una conexión libre, pre_ping descarta conexiones muertas
+  # y recycle evita cortes por inactividad del servidor. LIFO reutiliza las conexiones
+  # más recientes y deja que las ociosas del fondo expiren por recycle.
+  engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", 30)),
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    pool_use_lifo=True
+  )
+  MAX_CONEXIONES = DB_POOL_SIZE + DB_MAX_OVERFLOW
 else:
   # Configuración para SQLite
   engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 
+  # WAL permite lecturas concurrentes con una escritura; el resto reduce I/O en cada conexión
+  @event.listens_for(engine, "connect")
+  def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+logger = logging.getLogger(__name__)
+
+# Índices únicos que init_db no pudo crear porque la tabla ya tiene filas repetidas (bases con
+# datos anteriores a los índices). Mientras un índice falte, los endpoints validan los duplicados
+# con una consulta previa en lugar de confiar en el IntegrityError
+INDICES_UNICOS_FALTANTES = set()
+
+def _claves_repetidas(indice, limite: int = 20):
+  """Valores de las columnas del índice que aparecen en más de una fila (para el log)."""
+  columnas = list(indice.columns)
+  with engine.connect() as conn:
+    return conn.execute(
+      select(*columnas).group_by(*columnas).having(func.count() > 1).limit(limite)
+    ).all()
+
+def init_db():
+  """
+  Crea las tablas solo si falta alguna.
+  En los arranques en caliente (tablas ya creadas) es una sola consulta al catálogo,
+  en lugar de la verificación tabla por tabla de create_all.
+  Como create_all no toca tablas existentes, los índices declarados en los modelos
+  después de crear la base se agregan aparte. Si un índice no se puede crear la app arranca igual
+  y se vuelve a intentar en el próximo arranque. Un índice único que falla por filas repetidas
+  se registra con las claves repetidas (para limpiarlas) y queda en INDICES_UNICOS_FALTANTES.
+  """
+  INDICES_UNICOS_FALTANTES.clear()
+  inspector = inspect(engine)
+  existentes = set(inspector.get_table_names())
+  if not set(Base.metadata.tables).issubset(existentes):
+    Base.metadata.create_all(bind=engine)
+    return
+
+  for tabla in Base.metadata.tables.values():
+    if not tabla.indexes:
+      continue
+    indices_existentes = {i["name"] for i in inspector.get_indexes(tabla.name)}
+    for indice in tabla.indexes:
+      if indice.name not in indices_existentes:
+        try:
+          indice.create(bind=engine, checkfirst=True)
+        except DBAPIError as error:
+          # Otro worker que arrancó a la vez pudo haberlo creado entre la verificación y el CREATE
+          if any(i["name"] == indice.name for i in inspect(engine).get_indexes(tabla.name)):
+            continue
+          if indice.unique:
+            INDICES_UNICOS_FALTANTES.add(indice.name)
+            logger.error(
+              "No se pudo crear el índice único %s: %s. Claves repetidas: %s. Hasta eliminarlas, "
+              "los duplicados se validan con una consulta antes de cada escritura",
+              indice.name, error.orig, _claves_repetidas(indice)
+            )
+          else:
+            logger.warning("No se pudo crear el índice %s: %s", indice.name, error.orig)
+          continue
+
+# Dependencia única para obtener la sesión de la base de datos.
+# Todas las rutas y dependencias de auth usan esta misma función: FastAPI cachea el resultado
+# por request, así que un endpoint autenticado comparte una sola sesión (y una sola conexión).
+def get_db():
+  db = SessionLocal()
+  try:
+    yield db
+  finally:
+    db.close()
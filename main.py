@@ -1,30 +1,63 @@
 # --- Importación de librerías ---
-from fastapi import FastAPI, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session, joinedload
+import json
+import os
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import anyio
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Row, bindparam, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.exc import DBAPIError, IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, selectinload
+from pydantic import TypeAdapter
+from pydantic_core import to_json
 from typing import List, Optional, Literal
-from datetime import datetime
 from contextlib import asynccontextmanager
 
 # --- Importación de archivos locales ---
 import models, schemas
-from database import SessionLocal, engine, Base
+from database import INDICES_UNICOS_FALTANTES, MAX_CONEXIONES, SessionLocal, engine, init_db, get_db
 from auth.auth_routes import router as auth_router
-from auth.auth_utils import get_admin_user
+from auth.auth_utils import get_admin_user, hash_password
+from auth.crud_user import get_user
 from utils.validators import (
     validate_horario_duration,
+    horario_duplicado,
+    recorrido_duplicado,
     validate_horario_unique,
     validate_recorrido_unique,
     validate_origen_destino_different,
-    validate_linea_nombre
+    validate_linea_nombre,
+    parse_hora_actual,
+    time_to_minutes
 )
+from utils.cache import TTLCache
+from utils.http_cache import etag_json_response
 
-# --- Importación del middleware de CORS ---
+# --- Importación de los middlewares de CORS y compresión ---
 from fastapi.middleware.cors import CORSMiddleware
-
-# --- Lifespan crea las tablas al iniciar la app ---
+from fastapi.middleware.gzip import GZipMiddleware
+
+# /conexiones/ es el endpoint más costoso (lee los horarios de todos los tramos candidatos). Se limita
+# cuántos cálculos corren a la vez, por debajo del pool de la base, para que un pico de consultas
+# espere su turno acá en lugar de agotar el pool y hacer fallar al resto de los endpoints.
+_CONEXIONES_LIMITER = anyio.CapacityLimiter(int(os.getenv("CONEXIONES_CONCURRENCY", 16)))
+
+# --- Lifespan crea las tablas al iniciar la app (solo si faltan) ---
+# Los endpoints def (sesión sync de SQLAlchemy) corren en el threadpool de anyio, que por
+# defecto tiene 40 threads: una ráfaga mayor queda encolada aunque la base tenga conexiones libres.
+# THREADPOOL_SIZE lo ajusta a la concurrencia real del despliegue. Con el pool de PostgreSQL, por
+# defecto son las conexiones del pool menos los threads reservados a conexiones (que usan su propio
+# limiter): con más threads que conexiones, el exceso espera en el pool y falla por timeout en vez
+# de esperar en la cola. Sin pool local (SQLite, PgBouncer) queda el valor de anyio.
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-  Base.metadata.create_all(bind=engine)
+  threads = os.getenv("THREADPOOL_SIZE")
+  if threads is None and MAX_CONEXIONES is not None:
+    threads = max(1, MAX_CONEXIONES - _CONEXIONES_LIMITER.total_tokens)
+  if threads is not None:
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(threads)
+  init_db()
   yield
 
 # --- Inicialización de la aplicación FastAPI ---
@@ -36,105 +69,306 @@ app = FastAPI(
 )
 
 # --- Configuración del middleware de CORS ---
-origins = [
+# frozenset: el chequeo de origen en cada request es una búsqueda O(1).
+# Los navegadores envían el Origin sin "/" final, así que se normaliza al armar el conjunto.
+origins = frozenset(o.rstrip("/") for o in [
     "http://localhost:5173",
     "http://localhost:3000",
     "https://tucubus-backend.onrender.com",
     "https://tucubus-frontend.vercel.app"
-]
+])
 
 app.add_middleware(
   CORSMiddleware,
   allow_origins=origins,
   allow_credentials=True,
-  allow_methods=["*"],
-  allow_headers=["*"],
+  # Listas explícitas: son los únicos métodos y headers no simples que usa el frontend
+  allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+  allow_headers=["Authorization", "Content-Type", "If-None-Match"],
+  expose_headers=["X-Cache"],  # el frontend puede avisar cuando los datos vienen del respaldo
+  max_age=86400,  # el navegador cachea el preflight (OPTIONS) hasta 24 h
 )
 
-# --- Dependencia para obtener la sesión de la base de datos ---
-def get_db():
-  db = SessionLocal()
-  try:
-    yield db
-  finally:
-    db.close()
+# --- Compresión de respuestas ---
+# Las listas de horarios repiten claves y horas "HH:MM": gzip las reduce varias veces.
+# Nivel 5 para no cargar la CPU; las respuestas chicas no se comprimen.
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
 
-@app.get("/debug-db")
+# Expone la URL de la base (con credenciales) y el estado del pool: solo administradores
+@app.get("/debug-db", dependencies=[Depends(get_admin_user)])
 def debug_db():
-    import os
-    return {"DATABASE_URL": os.getenv("DATABASE_URL")}
+    return {"DATABASE_URL": os.getenv("DATABASE_URL"), "pool": engine.pool.status()}
 
 # --- Rutas de la API ---
 # ========== ENDPOINT RAÍZ ==========
-@app.get('/', tags=["Info"])
-async def raiz():
-  return {
-    "nombre": "API de Horarios de Colectivos",
-    "version": "1.0.0",
-    "descripción": "API REST para gestionar horarios de colectivos y conexiones utilizando FastAPI y SQLAlchemy.",
-    "documentación": "Visita /docs para la documentación interactiva con Swagger de la API.",
-    "endpoints": {
-      "GET /": "Información sobre la API.",
-      "GET /docs": "Documentación interactiva con Swagger.",
-      "App": {
-        "GET /horarios-por-recorrido/{id}?tipo_dia=...": "Lista de horarios para un recorrido específico y tipo de día.",
-        "GET /conexiones?tipo_dia=...": "Calcula las conexiones entre recorridos basándose en los horarios."
-      },
-      "Admin (CRUD)": {
-        "GET /lineas": "Lista todas las líneas de colectivos.",
-        "POST /lineas": "Crea una nueva línea de colectivo.",
-        "GET /recorridos": "Lista todos los recorridos.",
-        "POST /recorridos": "Crea un nuevo recorrido.",
-        "POST /horarios": "Crea un nuevo horario.",
-      }
+# La respuesta es constante: se serializa una sola vez al importar el módulo
+_RAIZ_BODY = json.dumps({
+  "nombre": "API de Horarios de Colectivos",
+  "version": "1.0.0",
+  "descripción": "API REST para gestionar horarios de colectivos y conexiones utilizando FastAPI y SQLAlchemy.",
+  "documentación": "Visita /docs para la documentación interactiva con Swagger de la API.",
+  "endpoints": {
+    "GET /": "Información sobre la API.",
+    "GET /docs": "Documentación interactiva con Swagger.",
+    "App": {
+      "GET /horarios-por-recorrido/{id}?tipo_dia=...": "Lista de horarios para un recorrido específico y tipo de día.",
+      "GET /conexiones?tipo_dia=...": "Calcula las conexiones entre recorridos basándose en los horarios."
+    },
+    "Admin (CRUD)": {
+      "GET /lineas": "Lista todas las líneas de colectivos.",
+      "POST /lineas": "Crea una nueva línea de colectivo.",
+      "GET /recorridos": "Lista todos los recorridos.",
+      "POST /recorridos": "Crea un nuevo recorrido.",
+      "POST /horarios": "Crea un nuevo horario.",
     }
   }
+}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+@app.get('/', tags=["Info"])
+async def raiz():
+  return Response(content=_RAIZ_BODY, media_type="application/json")
 
 # ========== ENDPOINTS GET ==========
+# Serializador de GET /lineas/, que se arma desde objetos ORM con relaciones anidadas
+_LINEAS_ADAPTER = TypeAdapter(List[schemas.Linea])
+
+# Las filas de las consultas de columnas ya tienen los tipos de los esquemas de respuesta:
+# se pasan a dicts con las claves en el orden del esquema y se serializan directo con
+# pydantic-core (to_json), sin volver a validarlas
+_CAMPOS_HORARIO = tuple(schemas.Horario.model_fields)
+_CAMPOS_HORARIO_CON_RECORRIDO = tuple(schemas.HorarioConRecorrido.model_fields)
+_CAMPOS_RECORRIDO = tuple(campo for campo in schemas.Recorrido.model_fields if campo != "horarios")
+
+def _como_esquema(fila, campos) -> dict:
+    return {campo: fila[campo] for campo in campos}
+
+# Cachés de lectura: cuerpos serializados de GET /lineas/ (incluye recorridos y horarios anidados),
+# GET /recorridos/ y GET /horarios-por-recorrido, y conexiones calculadas por (origen, destino, tipo_dia).
+# Se invalidan en cada escritura de líneas, recorridos u horarios; el TTL acota cuánto puede
+# quedar desactualizado otro worker que no vio esa escritura.
+_lineas_cache = TTLCache(maxsize=1, ttl=30)
+_recorridos_cache = TTLCache(maxsize=1, ttl=30)
+_horarios_recorrido_cache = TTLCache(maxsize=1024, ttl=30)
+_conexiones_cache = TTLCache(maxsize=512, ttl=30)
+
+# Última versión buena de cada valor cacheado, por (caché, clave). No se borra al invalidar:
+# solo se usa si la base falla al recalcular, para responder con datos algo viejos
+# (marcados con X-Cache: STALE) en lugar de un 500
+_respaldo_cache = TTLCache(maxsize=4096, ttl=24 * 60 * 60)
+
+# Fallas de la base que habilitan el respaldo: errores del driver y el timeout del pool.
+# Los errores de programación de SQLAlchemy no se ocultan
+_ERRORES_BASE = (DBAPIError, PoolTimeoutError)
+
+# Aumenta en cada invalidación: un resultado calculado mientras ocurría una escritura
+# no se guarda, porque podría haber leído los datos anteriores
+_generacion_datos = 0
+
+def _invalidar_caches():
+    """Descarta las respuestas cacheadas después de modificar líneas, recorridos u horarios."""
+    global _generacion_datos
+    _generacion_datos += 1
+    _lineas_cache.clear()
+    _recorridos_cache.clear()
+    _horarios_recorrido_cache.clear()
+    _conexiones_cache.clear()
+
+def _cacheado(cache: TTLCache, clave, calcular):
+    """
+    Devuelve (valor, obsoleto): el valor cacheado, o lo calcula y lo guarda (si no hubo
+    escrituras mientras tanto). Si la base falla y hay respaldo, lo devuelve con obsoleto=True.
+    """
+    valor = cache.get(clave)
+    if valor is not None:
+        return valor, False
+    generacion = _generacion_datos
+    try:
+        valor = calcular()
+    except _ERRORES_BASE:
+        # Sin respaldo, la falla de la base sigue su curso
+        respaldo = _respaldo(cache, clave)
+        if respaldo is None:
+            raise
+        return respaldo, True
+    _guardar(cache, clave, valor, generacion)
+    return valor, False
+
+def _guardar(cache: TTLCache, clave, valor, generacion: int):
+    if generacion == _generacion_datos:
+        cache.set(clave, valor)
+        _respaldo_cache.set((cache, clave), valor)
+
+def _respaldo(cache: TTLCache, clave):
+    """Última versión buena de un valor cacheado, o None si nunca se calculó."""
+    return _respaldo_cache.get((cache, clave))
+
+def _marcar_obsoleta(respuesta: Response, obsoleto: bool) -> Response:
+    if obsoleto:
+        respuesta.headers["X-Cache"] = "STALE"
+    return respuesta
+
+def _con_sesion(funcion, *args):
+    """Ejecuta funcion(*args, db) con una sesión propia, que se cierra al terminar."""
+    with SessionLocal() as db:
+        return funcion(*args, db)
+
+async def _cacheado_en_hilo(cache: TTLCache, clave, calcular, *args, limiter=None):
+    """
+    Como _cacheado, para endpoints async: un acierto se responde en el event loop, sin tomar
+    un hilo del threadpool ni abrir sesión. Solo al calcular se pasa a un hilo, con su propia
+    sesión (calcular recibe *args y la sesión al final).
+    """
+    valor = cache.get(clave)
+    if valor is not None:
+        return valor, False
+    generacion = _generacion_datos
+    try:
+        valor = await anyio.to_thread.run_sync(_con_sesion, calcular, *args, limiter=limiter)
+    except _ERRORES_BASE:
+        # Sin respaldo, la falla de la base sigue su curso
+        respaldo = _respaldo(cache, clave)
+        if respaldo is None:
+            raise
+        return respaldo, True
+    _guardar(cache, clave, valor, generacion)
+    return valor, False
+
 @app.get('/lineas/', response_model=List[schemas.Linea], tags=["Admin"])
-def get_lineas(db: Session = Depends(get_db)):
-    """Obtener todas las líneas (público, no requiere autenticación)"""
-    lineas = db.query(models.Linea).all()
-    return lineas
+def get_lineas(request: Request, db: Session = Depends(get_db)):
+    """Obtener todas las líneas (público, no requiere autenticación). Soporta If-None-Match."""
+    def serializar():
+        lineas = db.scalars(
+            select(models.Linea).options(
+                selectinload(models.Linea.recorridos).selectinload(models.Recorrido.horarios)
+            )
+        ).all()
+        return _LINEAS_ADAPTER.dump_json(_LINEAS_ADAPTER.validate_python(lineas))
+
+    body, obsoleto = _cacheado(_lineas_cache, "lineas", serializar)
+    return _marcar_obsoleta(etag_json_response(request, body), obsoleto)
 
 @app.get('/recorridos/', response_model=List[schemas.Recorrido], tags=["Admin"])
-def get_recorridos(db: Session = Depends(get_db)):
-    recorridos = db.query(models.Recorrido).options(
-        joinedload(models.Recorrido.linea)
-    ).all()
+def get_recorridos(request: Request, db: Session = Depends(get_db)):
+    """Obtener todos los recorridos (público). Soporta If-None-Match."""
+    def serializar():
+        # Dos consultas de columnas (recorridos con su línea, y todos los horarios),
+        # sin instancias ORM; los horarios se agrupan por recorrido en Python
+        recorridos = db.execute(
+            select(
+                models.Recorrido.id,
+                models.Recorrido.origen,
+                models.Recorrido.destino,
+                models.Recorrido.linea_id,
+                models.Linea.nombre.label("linea_nombre")
+            )
+            .outerjoin(models.Recorrido.linea)
+            .order_by(models.Recorrido.id)
+        ).mappings().all()
+
+        horarios_por_recorrido = defaultdict(list)
+        for h in db.execute(
+            select(
+                models.Horario.id,
+                models.Horario.tipo_dia,
+                models.Horario.hora_salida,
+                models.Horario.hora_llegada,
+                models.Horario.recorrido_id,
+                models.Horario.directo
+            # Orden del índice compuesto: por tipo de día y hora dentro de cada recorrido
+            ).order_by(models.Horario.recorrido_id, models.Horario.tipo_dia, models.Horario.hora_salida, models.Horario.id)
+        ).mappings():
+            horarios_por_recorrido[h["recorrido_id"]].append(_como_esquema(h, _CAMPOS_HORARIO))
+
+        resultado = [
+            {**_como_esquema(r, _CAMPOS_RECORRIDO), "horarios": horarios_por_recorrido.get(r["id"], [])}
+            for r in recorridos
+        ]
+        return to_json(resultado)
+
+    body, obsoleto = _cacheado(_recorridos_cache, "recorridos", serializar)
+    return _marcar_obsoleta(etag_json_response(request, body), obsoleto)
+
+# Columnas de HorarioConRecorrido: el horario con origen, destino y nombre de la línea
+def _select_horarios_con_recorrido():
+    return (
+        select(
+            models.Horario.id,
+            models.Horario.tipo_dia,
+            models.Horario.hora_salida,
+            models.Horario.hora_llegada,
+            models.Horario.recorrido_id,
+            models.Horario.directo,
+            models.Recorrido.origen,
+            models.Recorrido.destino,
+            models.Linea.nombre.label("linea_nombre")
+        )
+        .select_from(models.Horario)
+        .join(models.Horario.recorrido)
+        .join(models.Recorrido.linea)
+    )
 
-    resultado = []
-    for r in recorridos:
-        recorrido_dict = {
-            "id": r.id,
-            "origen": r.origen,
-            "destino": r.destino,
-            "linea_id": r.linea_id,
-            "linea_nombre": r.linea.nombre if r.linea else None,
-            "horarios": r.horarios
-        }
-        resultado.append(recorrido_dict)
-    return resultado
+def _horarios_con_recorrido_json(filas) -> bytes:
+    return to_json([_como_esquema(fila, _CAMPOS_HORARIO_CON_RECORRIDO) for fila in filas])
 
 @app.get('/horarios/', response_model=List[schemas.HorarioConRecorrido], tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def get_horarios(db: Session = Depends(get_db)):
-    """Obtener todos los horarios (SOLO Administradores autenticados)"""
-    horarios = db.query(models.Horario).join(models.Horario.recorrido).join(models.Recorrido.linea).all()
-
-    resultado = []
-    for h in horarios:
-        resultado.append({
-            "id": h.id,
-            "tipo_dia": h.tipo_dia,
-            "hora_salida": h.hora_salida,
-            "hora_llegada": h.hora_llegada,
-            "recorrido_id": h.recorrido_id,
-            "directo": h.directo,
-            "origen": h.recorrido.origen if h.recorrido else None,
-            "destino": h.recorrido.destino if h.recorrido else None,
-            "linea_nombre": h.recorrido.linea.nombre if h.recorrido.linea else None
-        })
-    return resultado
+    """
+    Obtener todos los horarios (SOLO Administradores autenticados).
+    La respuesta se envía en stream: las filas se leen en lotes y se serializan por lote,
+    sin armar la lista completa en memoria.
+    """
+    horarios = db.execute(
+        _select_horarios_con_recorrido().execution_options(yield_per=500)
+    ).mappings()
+
+    def generar_json():
+        yield b"["
+        separador = b""
+        # Cada lote de yield_per filas se serializa en una sola llamada a pydantic-core
+        for lote in horarios.partitions():
+            # Cada lote sale como "[...]": se quitan los corchetes para encadenar los lotes
+            yield separador + _horarios_con_recorrido_json(lote)[1:-1]
+            separador = b","
+        yield b"]"
+
+    return StreamingResponse(generar_json(), media_type="application/json")
+
+def _validar_antes_de_escribir(db: Session, modelo, registro_id: int, detalle_404: str, validar, *args):
+    """
+    Corre una validación del body antes del UPDATE, para no escribir (ni tomar locks) con datos inválidos.
+    Si falla, se confirma que el registro exista: el 404 tiene prioridad sobre el 400, como cuando
+    el objeto se cargaba antes de validar. La consulta extra solo ocurre en el camino de error.
+    """
+    try:
+        validar(*args)
+    except HTTPException:
+        if db.scalar(select(1).where(modelo.id == registro_id)) is None:
+            raise HTTPException(status_code=404, detail=detalle_404)
+        raise
+
+def _indice(modelo, nombre: str):
+    return next(indice for indice in modelo.__table__.indexes if indice.name == nombre)
+
+# Índices únicos que rechazan los duplicados al escribir. Si init_db no pudo crearlos (la base ya
+# tenía filas repetidas), se vuelve a la consulta previa de duplicados
+_UX_RECORRIDO = _indice(models.Recorrido, "ux_recorrido_linea_origen_destino")
+_UX_HORARIO = _indice(models.Horario, "ux_horario_rec_dia_salida")
+
+def _falta_indice(indice) -> bool:
+    return indice.name in INDICES_UNICOS_FALTANTES
+
+def _viola_indice(error: IntegrityError, indice) -> bool:
+    """
+    Indica si el IntegrityError lo causó este índice único. Las demás violaciones (por ejemplo una FK
+    a un registro borrado entre la validación y el commit) no son duplicados y deben propagarse.
+    """
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None:
+        # psycopg informa el nombre de la restricción violada
+        return diag.constraint_name == indice.name
+    # SQLite solo informa las columnas: "UNIQUE constraint failed: tabla.col1, tabla.col2"
+    columnas = ", ".join(f"{columna.table.name}.{columna.name}" for columna in indice.columns)
+    return str(error.orig) == f"UNIQUE constraint failed: {columnas}"
 
 # ========== ENDPOINTS POST ==========
 @app.post('/lineas/', response_model=schemas.Linea, status_code=status.HTTP_201_CREATED, tags=["Admin"], dependencies=[Depends(get_admin_user)])
@@ -144,21 +378,31 @@ def crear_linea(linea: schemas.LineaCreate, db: Session = Depends(get_db)):
     db_linea = models.Linea(**linea.model_dump())
     db.add(db_linea)
     db.commit()
+    _invalidar_caches()
     db.refresh(db_linea)
     return db_linea
 
 @app.put('/lineas/{linea_id}', response_model=schemas.Linea, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def update_linea(linea_id: int, linea: schemas.LineaCreate, db: Session = Depends(get_db)):
     """Actualizar línea (Solo Administradores autenticados)"""
-    db_linea = db.query(models.Linea).filter(models.Linea.id == linea_id).first()
-    if not db_linea:
+    _validar_antes_de_escribir(db, models.Linea, linea_id, "Línea no encontrada", validate_linea_nombre, linea.nombre)
+
+    # UPDATE ... RETURNING: actualiza y devuelve la línea en una sola consulta (None si no existe).
+    # La respuesta incluye recorridos y horarios: se cargan con selectinload en vez de
+    # un SELECT de horarios por cada recorrido
+    db_linea = db.scalars(
+        update(models.Linea).where(models.Linea.id == linea_id).values(nombre=linea.nombre)
+        .returning(models.Linea)
+        .options(selectinload(models.Linea.recorridos).selectinload(models.Recorrido.horarios))
+    ).one_or_none()
+    if db_linea is None:
         raise HTTPException(status_code=404, detail="Línea no encontrada")
-    
-    validate_linea_nombre(linea.nombre)
-    db_linea.nombre = linea.nombre
+
+    # Se serializa antes del commit, que expira los objetos y obligaría a recargarlos
+    respuesta = schemas.Linea.model_validate(db_linea)
     db.commit()
-    db.refresh(db_linea)
-    return db_linea
+    _invalidar_caches()
+    return respuesta
 
 @app.delete('/lineas/{linea_id}', status_code=204, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def delete_linea(
@@ -172,100 +416,123 @@ def delete_linea(
     - Si force=False y hay recorridos asociados, devuelve 409 con detalles
     - Si force=True, elimina en cascada todos los datos asociados
     """
-    # 1. Buscar la línea
-    db_linea = db.query(models.Linea).filter(models.Linea.id == linea_id).first()
-    if not db_linea:
+    # 1. Sin force: si hay recorridos asociados, devolver conflicto con detalles
+    if not force:
+        recorridos = db.execute(
+            select(models.Recorrido.id, models.Recorrido.origen, models.Recorrido.destino)
+            .where(models.Recorrido.linea_id == linea_id)
+            .order_by(models.Recorrido.id)
+        ).all()
+
+        if recorridos:
+            if db.get(models.Linea, linea_id) is None:
+                raise HTTPException(status_code=404, detail="Línea no encontrada")
+
+            # Total de horarios afectados en una sola consulta
+            total_horarios = db.scalar(
+                select(func.count(models.Horario.id))
+                .where(models.Horario.recorrido_id.in_([r.id for r in recorridos]))
+            )
+
+            # Preparar información de recorridos
+            recorridos_info = [
+                {
+                    "id": r.id,
+                    "origen": r.origen,
+                    "destino": r.destino
+                }
+                for r in recorridos
+            ]
+
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "message": "La línea tiene datos asociados que serán eliminados",
+                    "recorridos_count": len(recorridos),
+                    "horarios_count": total_horarios,
+                    "recorridos": recorridos_info
+                }
+            )
+
+    # 2. Con force, eliminar en cascada horarios y recorridos (un DELETE por tabla)
+    else:
+        recorridos_ids = select(models.Recorrido.id).where(models.Recorrido.linea_id == linea_id)
+        db.execute(delete(models.Horario).where(models.Horario.recorrido_id.in_(recorridos_ids)))
+        db.execute(delete(models.Recorrido).where(models.Recorrido.linea_id == linea_id))
+
+    # 3. Eliminar la línea; si no existía no se borró nada y se deshace lo anterior
+    result = db.execute(delete(models.Linea).where(models.Linea.id == linea_id))
+    if result.rowcount == 0:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Línea no encontrada")
-    
-    # 2. Buscar recorridos asociados
-    recorridos = db.query(models.Recorrido).filter(
-        models.Recorrido.linea_id == linea_id
-    ).all()
-    
-    # 3. Si hay recorridos y no es force, devolver conflicto con detalles
-    if recorridos and not force:
-        # Calcular total de horarios afectados
-        total_horarios = 0
-        for recorrido in recorridos:
-            count = db.query(models.Horario).filter(
-                models.Horario.recorrido_id == recorrido.id
-            ).count()
-            total_horarios += count
-        
-        # Preparar información de recorridos
-        recorridos_info = [
-            {
-                "id": r.id,
-                "origen": r.origen,
-                "destino": r.destino
-            }
-            for r in recorridos
-        ]
-        
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail={
-                "message": "La línea tiene datos asociados que serán eliminados",
-                "recorridos_count": len(recorridos),
-                "horarios_count": total_horarios,
-                "recorridos": recorridos_info
-            }
-        )
-    
-    # 4. Si force=True, eliminar en cascada
-    if force and recorridos:
-        for recorrido in recorridos:
-            # Eliminar horarios del recorrido
-            db.query(models.Horario).filter(
-                models.Horario.recorrido_id == recorrido.id
-            ).delete()
-            # Eliminar el recorrido
-            db.delete(recorrido)
-        
-        # Eliminar la línea
-        db.delete(db_linea)
-        db.commit()
-        return None
-    
-    # 5. Si no hay recorridos, eliminar directamente
-    db.delete(db_linea)
     db.commit()
+    _invalidar_caches()
     return None
 
 # CRUD para recorridos
+def _validar_linea_existe(db: Session, linea_id: int):
+    # Solo se verifica que la línea exista: no hace falta cargar el objeto
+    if db.scalar(select(1).where(models.Linea.id == linea_id)) is None:
+        raise HTTPException(status_code=404, detail="Línea no encontrada")
+
 @app.post('/recorridos/', response_model=schemas.Recorrido, status_code=status.HTTP_201_CREATED, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def crear_recorrido(recorrido: schemas.RecorridoCreate, db: Session = Depends(get_db)):
     """Crear recorrido (Solo Administradores autenticados)"""
     validate_origen_destino_different(recorrido.origen, recorrido.destino)
+    _validar_linea_existe(db, recorrido.linea_id)
+    if _falta_indice(_UX_RECORRIDO):
+        validate_recorrido_unique(db, recorrido.origen, recorrido.destino, recorrido.linea_id)
 
-    db_linea = db.query(models.Linea).filter(models.Linea.id == recorrido.linea_id).first()
-    if not db_linea:
-        raise HTTPException(status_code=404, detail="Línea no encontrada")
-    
-    validate_recorrido_unique(db, recorrido.origen, recorrido.destino, recorrido.linea_id)
-
+    # Sin consulta previa de duplicados: el índice único (linea_id, origen, destino) rechaza el INSERT
     db_recorrido = models.Recorrido(**recorrido.model_dump())
     db.add(db_recorrido)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as error:
+        db.rollback()
+        if not _viola_indice(error, _UX_RECORRIDO):
+            raise
+        raise recorrido_duplicado(recorrido.origen, recorrido.destino)
+    _invalidar_caches()
     db.refresh(db_recorrido)
     return db_recorrido
 
 @app.put('/recorridos/{recorrido_id}', response_model=schemas.Recorrido, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def update_recorrido(recorrido_id: int, recorrido: schemas.RecorridoCreate, db: Session = Depends(get_db)):
     """Actualizar recorrido (Solo Administradores autenticados)"""
-    db_recorrido = db.query(models.Recorrido).filter(models.Recorrido.id == recorrido_id).first()
-    if not db_recorrido:
+    _validar_antes_de_escribir(
+        db, models.Recorrido, recorrido_id, "Recorrido no encontrado",
+        validate_origen_destino_different, recorrido.origen, recorrido.destino
+    )
+    if _falta_indice(_UX_RECORRIDO):
+        _validar_antes_de_escribir(
+            db, models.Recorrido, recorrido_id, "Recorrido no encontrado",
+            validate_recorrido_unique, db, recorrido.origen, recorrido.destino, recorrido.linea_id, recorrido_id
+        )
+
+    # UPDATE ... RETURNING en lugar de cargar, modificar y refrescar el objeto.
+    # Si repite origen-destino en la línea, lo rechaza el índice único; si la línea no existe,
+    # la FK (recién ahí se consulta la línea, para responder 404)
+    try:
+        db_recorrido = db.scalars(
+            update(models.Recorrido).where(models.Recorrido.id == recorrido_id)
+            .values(**recorrido.model_dump())
+            .returning(models.Recorrido)
+            .options(selectinload(models.Recorrido.horarios))
+        ).one_or_none()
+    except IntegrityError as error:
+        db.rollback()
+        if _viola_indice(error, _UX_RECORRIDO):
+            raise recorrido_duplicado(recorrido.origen, recorrido.destino)
+        _validar_linea_existe(db, recorrido.linea_id)
+        raise
+    if db_recorrido is None:
         raise HTTPException(status_code=404, detail="Recorrido no encontrado")
-    
-    validate_origen_destino_different(recorrido.origen, recorrido.destino)
-    validate_recorrido_unique(db, recorrido.origen, recorrido.destino, recorrido.linea_id, exclude_id=recorrido_id)
 
-    db_recorrido.origen = recorrido.origen
-    db_recorrido.destino = recorrido.destino
-    db_recorrido.linea_id = recorrido.linea_id
+    respuesta = schemas.Recorrido.model_validate(db_recorrido)
     db.commit()
-    db.refresh(db_recorrido)
-    return db_recorrido
+    _invalidar_caches()
+    return respuesta
 
 @app.delete('/recorridos/{recorrido_id}', status_code=204, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def delete_recorrido(
@@ -279,60 +546,73 @@ def delete_recorrido(
     - Si force=False y hay horarios asociados, devuelve 409 con detalles
     - Si force=True, elimina en cascada todos los horarios asociados
     """
-    # 1. Buscar el recorrido
-    db_recorrido = db.query(models.Recorrido).filter(
-        models.Recorrido.id == recorrido_id
-    ).first()
-    if not db_recorrido:
+    # 1. Sin force: si hay horarios asociados, devolver conflicto con detalles
+    if not force:
+        horarios_ids = db.scalars(
+            select(models.Horario.id)
+            .where(models.Horario.recorrido_id == recorrido_id)
+            .order_by(models.Horario.id)
+        ).all()
+
+        if horarios_ids:
+            if db.get(models.Recorrido, recorrido_id) is None:
+                raise HTTPException(status_code=404, detail="Recorrido no encontrado")
+
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "message": "El recorrido tiene horarios asociados que serán eliminados",
+                    "horarios_count": len(horarios_ids),
+                    # Los primeros 10 IDs como preview
+                    "horarios_preview": horarios_ids[:10]
+                }
+            )
+
+    # 2. Con force, eliminar en cascada los horarios del recorrido
+    else:
+        db.execute(delete(models.Horario).where(models.Horario.recorrido_id == recorrido_id))
+
+    # 3. Eliminar el recorrido; si no existía no se borró nada y se deshace lo anterior
+    result = db.execute(delete(models.Recorrido).where(models.Recorrido.id == recorrido_id))
+    if result.rowcount == 0:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Recorrido no encontrado")
-    
-    # 2. Buscar horarios asociados
-    horarios = db.query(models.Horario).filter(
-        models.Horario.recorrido_id == recorrido_id
-    ).all()
-    
-    # 3. Si hay horarios y no es force, devolver conflicto con detalles
-    if horarios and not force:
-        # Tomar los primeros 10 IDs como preview
-        horarios_preview = [h.id for h in horarios[:10]]
-        
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail={
-                "message": "El recorrido tiene horarios asociados que serán eliminados",
-                "horarios_count": len(horarios),
-                "horarios_preview": horarios_preview
-            }
-        )
-    
-    # 4. Si force=True, eliminar en cascada
-    if force and horarios:
-        db.query(models.Horario).filter(
-            models.Horario.recorrido_id == recorrido_id
-        ).delete()
-        db.delete(db_recorrido)
-        db.commit()
-        return None
-    
-    # 5. Si no hay horarios, eliminar directamente
-    db.delete(db_recorrido)
     db.commit()
+    _invalidar_caches()
     return None
 
 # CRUD para horarios
+def _get_recorrido_con_linea(db: Session, recorrido_id: int):
+    """Origen, destino y nombre de línea de un recorrido en una sola consulta (None si no existe)."""
+    return db.execute(
+        select(models.Recorrido.origen, models.Recorrido.destino, models.Linea.nombre.label("linea_nombre"))
+        .join(models.Recorrido.linea)
+        .where(models.Recorrido.id == recorrido_id)
+    ).first()
+
 @app.post('/horarios/', response_model=schemas.HorarioConRecorrido, status_code=status.HTTP_201_CREATED, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def crear_horario(horario: schemas.HorarioCreate, db: Session = Depends(get_db)):
     """Crear horario (Solo Administradores autenticados)"""
     validate_horario_duration(horario.hora_salida, horario.hora_llegada)
-    validate_horario_unique(db, horario.recorrido_id, horario.tipo_dia, horario.hora_salida)
 
-    db_recorrido = db.query(models.Recorrido).join(models.Recorrido.linea).filter(models.Recorrido.id == horario.recorrido_id).first()
+    db_recorrido = _get_recorrido_con_linea(db, horario.recorrido_id)
     if not db_recorrido:
         raise HTTPException(status_code=404, detail="Recorrido no encontrado")
+    if _falta_indice(_UX_HORARIO):
+        validate_horario_unique(db, horario.recorrido_id, horario.tipo_dia, horario.hora_salida)
     
+    # Sin consulta previa de duplicados: el índice único (recorrido_id, tipo_dia, hora_salida)
+    # rechaza el INSERT
     db_horario = models.Horario(**horario.model_dump())
     db.add(db_horario)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as error:
+        db.rollback()
+        if not _viola_indice(error, _UX_HORARIO):
+            raise
+        raise horario_duplicado(horario.tipo_dia, horario.hora_salida)
+    _invalidar_caches()
     db.refresh(db_horario)
     return {
         "id": db_horario.id,
@@ -343,9 +623,92 @@ def crear_horario(horario: schemas.HorarioCreate, db: Session = Depends(get_db))
         "directo": db_horario.directo,
         "origen": db_recorrido.origen,
         "destino": db_recorrido.destino,
-        "linea_nombre": db_recorrido.linea.nombre if db_recorrido.linea else None
+        "linea_nombre": db_recorrido.linea_nombre
     }
 
+def _validar_horarios_nuevos(db: Session, claves):
+    """Rechaza el lote si alguna clave (recorrido_id, tipo_dia, hora_salida) ya existe en la base."""
+    existente = db.execute(
+        select(models.Horario.recorrido_id, models.Horario.tipo_dia, models.Horario.hora_salida).where(
+            tuple_(models.Horario.recorrido_id, models.Horario.tipo_dia, models.Horario.hora_salida).in_(claves)
+        ).limit(1)
+    ).first()
+    if existente is not None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ya existe un horario para el recorrido {existente.recorrido_id} a las {existente.hora_salida} en días {existente.tipo_dia}"
+        )
+
+@app.post('/horarios/bulk', response_model=List[schemas.HorarioConRecorrido], status_code=status.HTTP_201_CREATED, tags=["Admin"], dependencies=[Depends(get_admin_user)])
+def crear_horarios_bulk(
+    request: schemas.HorarioBulkCreate,
+    db: Session = Depends(get_db)
+):
+    """
+    Crear múltiples horarios en una sola transacción (un único INSERT multi-fila).
+    Máximo 500 horarios por solicitud. Si alguno es inválido no se crea ninguno.
+    """
+    for horario in request.horarios:
+        validate_horario_duration(horario.hora_salida, horario.hora_llegada)
+
+    # Validar que existan todos los recorridos con una sola consulta. Join y no outerjoin, como en
+    # _get_recorrido_con_linea: un recorrido sin línea no puede armar la respuesta y cuenta como faltante
+    recorrido_ids = {h.recorrido_id for h in request.horarios}
+    recorridos = {
+        r.id: r for r in db.execute(
+            select(
+                models.Recorrido.id,
+                models.Recorrido.origen,
+                models.Recorrido.destino,
+                models.Linea.nombre.label("linea_nombre")
+            ).join(models.Recorrido.linea).where(models.Recorrido.id.in_(recorrido_ids))
+        )
+    }
+    faltantes = sorted(recorrido_ids - recorridos.keys())
+    if faltantes:
+        raise HTTPException(status_code=404, detail=f"Recorridos no encontrados: {faltantes}")
+
+    # Validar duplicados dentro del lote
+    claves = set()
+    for h in request.horarios:
+        clave = (h.recorrido_id, h.tipo_dia, h.hora_salida)
+        if clave in claves:
+            raise HTTPException(
+                status_code=400,
+                detail=f"El lote repite el horario de las {h.hora_salida} en días {h.tipo_dia} para el recorrido {h.recorrido_id}"
+            )
+        claves.add(clave)
+
+    # Contra la base lo valida el índice único: solo si el INSERT falla (o si el índice falta)
+    # se busca cuál horario ya existía, para informarlo
+    if _falta_indice(_UX_HORARIO):
+        _validar_horarios_nuevos(db, claves)
+    filas = [h.model_dump() for h in request.horarios]
+    try:
+        ids = db.scalars(
+            insert(models.Horario).returning(models.Horario.id, sort_by_parameter_order=True),
+            filas
+        ).all()
+    except IntegrityError as error:
+        db.rollback()
+        if not _viola_indice(error, _UX_HORARIO):
+            raise
+        _validar_horarios_nuevos(db, claves)
+        raise HTTPException(status_code=400, detail="Alguno de los horarios ya existe")
+    db.commit()
+    _invalidar_caches()
+
+    return [
+        {
+            "id": horario_id,
+            **fila,
+            "origen": recorridos[fila["recorrido_id"]].origen,
+            "destino": recorridos[fila["recorrido_id"]].destino,
+            "linea_nombre": recorridos[fila["recorrido_id"]].linea_nombre
+        }
+        for horario_id, fila in zip(ids, filas)
+    ]
+
 @app.post('/horarios/bulk-delete', status_code=204, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def delete_horarios_bulk(
     request: schemas.BulkDeleteRequest,
@@ -355,86 +718,128 @@ def delete_horarios_bulk(
     Eliminar múltiples horarios de una vez.
     Máximo 500 horarios por solicitud.
     """
-    # Validar que los IDs existan
-    horarios_existentes = db.query(models.Horario).filter(
-        models.Horario.id.in_(request.ids)
-    ).all()
-    
-    if not horarios_existentes:
+    # Eliminar los horarios; si ninguno de los IDs existía no se borró nada
+    result = db.execute(delete(models.Horario).where(models.Horario.id.in_(request.ids)))
+    if result.rowcount == 0:
         raise HTTPException(
             status_code=404,
             detail="No se encontraron horarios con los IDs proporcionados"
         )
-    
-    # Eliminar los horarios
-    deleted_count = db.query(models.Horario).filter(
-        models.Horario.id.in_(request.ids)
-    ).delete(synchronize_session=False)
-    
+
     db.commit()
+    _invalidar_caches()
     
     return None
 
 @app.put('/horarios/{horario_id}', response_model=schemas.HorarioConRecorrido, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def update_horario(horario_id: int, horario: schemas.HorarioCreate, db: Session = Depends(get_db)):
     """Actualizar horario (Solo Administradores autenticados)"""
-    db_horario = db.query(models.Horario).filter(models.Horario.id == horario_id).first()
-    if not db_horario:
-        raise HTTPException(status_code=404, detail="Horario no encontrado")
-    
-    validate_horario_duration(horario.hora_salida, horario.hora_llegada)
-    validate_horario_unique(db, horario.recorrido_id, horario.tipo_dia, horario.hora_salida, exclude_id=horario_id)
-    
-    db_recorrido = db.query(models.Recorrido).join(models.Recorrido.linea).filter(models.Recorrido.id == horario.recorrido_id).first()
+    # El recorrido se busca antes de escribir: el UPDATE no puede apuntar a uno inexistente
+    db_recorrido = _get_recorrido_con_linea(db, horario.recorrido_id)
     if not db_recorrido:
         raise HTTPException(status_code=404, detail="Recorrido no encontrado")
 
-    db_horario.tipo_dia = horario.tipo_dia
-    db_horario.hora_salida = horario.hora_salida
-    db_horario.hora_llegada = horario.hora_llegada
-    db_horario.recorrido_id = horario.recorrido_id
-    db_horario.directo = horario.directo
+    _validar_antes_de_escribir(
+        db, models.Horario, horario_id, "Horario no encontrado",
+        validate_horario_duration, horario.hora_salida, horario.hora_llegada
+    )
+    if _falta_indice(_UX_HORARIO):
+        _validar_antes_de_escribir(
+            db, models.Horario, horario_id, "Horario no encontrado",
+            validate_horario_unique, db, horario.recorrido_id, horario.tipo_dia, horario.hora_salida, horario_id
+        )
+
+    # UPDATE directo: no se carga el objeto ni se vuelve a leer después del commit,
+    # la respuesta se arma con los valores que se acaban de guardar.
+    # Si no actualizó ninguna fila, el horario no existe; si repite la salida de otro horario
+    # del recorrido, lo rechaza el índice único
+    valores = horario.model_dump()
+    try:
+        resultado = db.execute(update(models.Horario).where(models.Horario.id == horario_id).values(**valores))
+    except IntegrityError as error:
+        db.rollback()
+        if not _viola_indice(error, _UX_HORARIO):
+            raise
+        raise horario_duplicado(horario.tipo_dia, horario.hora_salida)
+    if resultado.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Horario no encontrado")
     db.commit()
-    db.refresh(db_horario)
+    _invalidar_caches()
     return {
-        "id": db_horario.id,
-        "tipo_dia": db_horario.tipo_dia,
-        "hora_salida": db_horario.hora_salida,
-        "hora_llegada": db_horario.hora_llegada,
-        "recorrido_id": db_horario.recorrido_id,
-        "directo": db_horario.directo,
+        "id": horario_id,
+        **valores,
         "origen": db_recorrido.origen,
         "destino": db_recorrido.destino,
-        "linea_nombre": db_recorrido.linea.nombre if db_recorrido.linea else None
+        "linea_nombre": db_recorrido.linea_nombre
     }
 
 @app.delete('/horarios/{horario_id}', status_code=204, tags=["Admin"], dependencies=[Depends(get_admin_user)])
 def delete_horario(horario_id: int, db: Session = Depends(get_db)):
     """Eliminar horario (Solo Administradores autenticados)"""
-    db_horario = db.query(models.Horario).filter(models.Horario.id == horario_id).first()
-    if not db_horario:
+    result = db.execute(delete(models.Horario).where(models.Horario.id == horario_id))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Horario no encontrado")
-    db.delete(db_horario)
     db.commit()
+    _invalidar_caches()
     return None
 
 # ========== ENDPOINTS COMPLEJOS ==========
+# El id desempata salidas a la misma hora, así el cuerpo (y su ETag) es estable.
+# Solo las columnas de la respuesta, como mappings: sin instancias ORM ni identity map
+_HORARIOS_POR_RECORRIDO_STMT = (
+  select(
+    models.Horario.id,
+    models.Horario.tipo_dia,
+    models.Horario.hora_salida,
+    models.Horario.hora_llegada,
+    models.Horario.recorrido_id,
+    models.Horario.directo
+  ).where(
+    models.Horario.recorrido_id == bindparam("recorrido_id"),
+    models.Horario.tipo_dia == bindparam("tipo_dia")
+  ).order_by(models.Horario.hora_salida, models.Horario.id)
+)
+
 @app.get('/horarios-por-recorrido/{recorrido_id}', response_model=List[schemas.Horario], tags=["App"])
-def get_horarios_por_recorrido(
+async def get_horarios_por_recorrido(
+  request: Request,
   recorrido_id: int,
-  tipo_dia: Literal["habil", "feriado", "sábado", "domingo"],
-  db: Session = Depends(get_db)
+  tipo_dia: Literal["habil", "feriado", "sábado", "domingo"]
   ):
-  # Devuelve los horarios para un recorrido específico, filtrado por tipo de día
-  horarios = db.query(models.Horario).filter(
-    models.Horario.recorrido_id == recorrido_id,
-    models.Horario.tipo_dia == tipo_dia
-  ).order_by(models.Horario.hora_salida).all()
+  # Devuelve los horarios para un recorrido específico, filtrado por tipo de día.
+  body, obsoleto = await _cacheado_en_hilo(
+    _horarios_recorrido_cache, (recorrido_id, tipo_dia),
+    _serializar_horarios_recorrido, recorrido_id, tipo_dia
+  )
+  return _marcar_obsoleta(etag_json_response(request, body), obsoleto)
+
+def _serializar_horarios_recorrido(recorrido_id: int, tipo_dia: str, db: Session) -> bytes:
+  horarios = db.execute(
+    _HORARIOS_POR_RECORRIDO_STMT, {"recorrido_id": recorrido_id, "tipo_dia": tipo_dia}
+  ).mappings().all()
 
   if not horarios:
     raise HTTPException(status_code=404, detail="No se encontraron horarios")
-  
-  return horarios
+
+  return to_json([_como_esquema(h, _CAMPOS_HORARIO) for h in horarios])
+
+# Consultas de horarios directos, armadas una sola vez con parámetros: cada request solo
+# ejecuta (la sentencia y su clave de caché de compilación se reutilizan)
+_FILTROS_DIRECTOS = (
+    models.Recorrido.origen == bindparam("origen"),
+    models.Recorrido.destino == bindparam("destino"),
+    models.Horario.tipo_dia == bindparam("tipo_dia"),
+)
+# HH:MM con ceros a la izquierda ordena igual que la hora: el corte va en el WHERE
+_HORARIOS_DIRECTOS_STMT = (
+    _select_horarios_con_recorrido()
+    .where(*_FILTROS_DIRECTOS, models.Horario.hora_salida >= bindparam("desde"))
+    .order_by(models.Horario.hora_salida)
+)
+_HAY_HORARIOS_DIRECTOS_STMT = (
+    select(1).select_from(models.Horario).join(models.Horario.recorrido).join(models.Recorrido.linea)
+    .where(*_FILTROS_DIRECTOS).limit(1)
+)
 
 @app.get('/horarios-directos/', response_model=List[schemas.HorarioConRecorrido], tags=["App"])
 def get_horarios_directos(
@@ -454,173 +859,149 @@ def get_horarios_directos(
     
     Retorna los horarios ordenados por hora de salida.
     """
-    # Validar hora_actual
-    try:
-        partes = hora_actual.split(":")
-        if len(partes) != 2:
-            raise ValueError()
-        h, m = int(partes[0]), int(partes[1])
-        if not (0 <= h <= 23 and 0 <= m <= 59):
-            raise ValueError()
-    except Exception:
-        raise HTTPException(
-            status_code=400, 
-            detail="hora_actual debe ser HH:MM entre 00:00 y 23:59"
-        )
-    
-    horarios_completos = db.query(models.Horario).join(models.Horario.recorrido).join(models.Recorrido.linea).filter(
-        models.Recorrido.origen == origen,
-        models.Recorrido.destino == destino,
-        models.Horario.tipo_dia == tipo_dia,
-    ).order_by(models.Horario.hora_salida).all()
-
-    if not horarios_completos:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"No existe recorrido directo o no hay horarios disponibles para {origen} → {destino} en días {tipo_dia}"
-        )
-    
-    def str_to_minutos(hora):
-        h, m = map(int, hora.split(":"))
-        return h * 60 + m
-    
-    min_actual = str_to_minutos(hora_actual)
-
-    horarios_filtrados = []
-    for horario in horarios_completos:
-        if str_to_minutos(horario.hora_salida) >= min_actual:
-            horarios_filtrados.append({
-                "id": horario.id,
-                "tipo_dia": horario.tipo_dia,
-                "hora_salida": horario.hora_salida,
-                "hora_llegada": horario.hora_llegada,
-                "recorrido_id": horario.recorrido_id,
-                "directo": horario.directo,
-                "origen": horario.recorrido.origen if horario.recorrido else None,
-                "destino": horario.recorrido.destino if horario.recorrido else None,
-                "linea_nombre": horario.recorrido.linea.nombre if horario.recorrido else None
-            })
+    min_actual = parse_hora_actual(hora_actual)
+
+    # hora_actual se normaliza a HH:MM, porque puede venir como 9:00
+    params = {
+        "origen": origen,
+        "destino": destino,
+        "tipo_dia": tipo_dia,
+        "desde": f"{min_actual // 60:02d}:{min_actual % 60:02d}",
+    }
+    horarios_filtrados = db.execute(_HORARIOS_DIRECTOS_STMT, params).mappings().all()
 
     if not horarios_filtrados:
+        # Solo sin resultados hace falta distinguir "no hay recorrido" de "no hay más horarios hoy"
+        hay_horarios = db.scalar(_HAY_HORARIOS_DIRECTOS_STMT, params)
+        if hay_horarios is None:
+            raise HTTPException(
+                status_code=404, 
+                detail=f"No existe recorrido directo o no hay horarios disponibles para {origen} → {destino} en días {tipo_dia}"
+            )
         raise HTTPException(
             status_code=404,
             detail=f"No hay más horarios disponibles después de las {hora_actual}"
         )
     
-    return horarios_filtrados
+    return Response(content=_horarios_con_recorrido_json(horarios_filtrados), media_type="application/json")
+
 
 @app.get('/conexiones/', response_model=List[schemas.Conexion], tags=["App"])
-def calcular_conexiones(
+async def calcular_conexiones(
     origen: str,
     destino: str,
     tipo_dia: Literal["habil", "sábado", "domingo"],
-    hora_actual: str = '00:00',
-    db: Session = Depends(get_db)
+    hora_actual: str = '00:00'
 ):
     """
     Calcula las conexiones óptimas (Origen -> Conexión -> Destino) a partir de la hora_actual.
     """
+    min_actual = parse_hora_actual(hora_actual)
+
+    # Cada tramo A se empareja con el primer B posterior sin depender de los demás, así que
+    # las conexiones desde hora_actual son un sufijo de las del día completo (ordenadas por salida).
+    # Se calcula el día completo una vez y cada consulta solo recorta la lista cacheada.
+    cacheado, obsoleto = await _cacheado_en_hilo(
+        _conexiones_cache, (origen, destino, tipo_dia),
+        _calcular_conexiones, origen, destino, tipo_dia,
+        limiter=_CONEXIONES_LIMITER
+    )
+
+    # Las conexiones se guardan ya serializadas: cada consulta solo concatena el sufijo,
+    # sin volver a validar ni serializar con pydantic
+    salidas_min, conexiones_json = cacheado
+    desde = bisect_left(salidas_min, min_actual)
+    if desde == len(conexiones_json):
+        raise HTTPException(
+            status_code=404,
+            detail="No se encontraron combinaciones de conexiones posibles."
+        )
+    return _marcar_obsoleta(
+        Response(content=b"[" + b",".join(conexiones_json[desde:]) + b"]", media_type="application/json"),
+        obsoleto
+    )
+
+# Horarios candidatos a tramo de una conexión, con el nombre de la línea
+# (outer join: un recorrido sin línea igual conecta)
+_TRAMOS_CONEXION_STMT = (
+    select(
+        models.Horario.hora_salida,
+        models.Horario.hora_llegada,
+        models.Recorrido.origen,
+        models.Recorrido.destino,
+        models.Linea.nombre
+    )
+    .select_from(models.Horario)
+    .join(models.Horario.recorrido)
+    .outerjoin(models.Recorrido.linea)
+    .where(
+        models.Horario.tipo_dia == bindparam("tipo_dia"),
+        or_(models.Recorrido.origen == bindparam("origen"), models.Recorrido.destino == bindparam("destino"))
+    )
+    .order_by(models.Horario.hora_salida, models.Horario.id)
+)
 
-    # Validar hora_actual 
-    try:
-        partes = hora_actual.split(":")
-        if len(partes) != 2:
-            raise ValueError()
-        h, m = int(partes[0]), int(partes[1])
-        if not (0 <= h <= 23 and 0 <= m <= 59):
-            raise ValueError()
-    except Exception:
-        raise HTTPException(status_code=400, detail="hora_actual debe ser HH:MM entre 00:00 y 23:59")
-    
-    FMT = "%H:%M"
+def _calcular_conexiones(origen: str, destino: str, tipo_dia: str, db: Session):
+    """
+    Todas las conexiones del día para (origen, destino, tipo_dia), ordenadas por salida.
+    Devuelve (minutos de salida del tramo A, conexiones serializadas a JSON), listas paralelas.
+    """
 
-    # 1. Encontrar posibles ciudades de conexión
-    ciudades_de_salida = db.query(models.Recorrido.origen).distinct().all()
-    ciudades_de_llegada = db.query(models.Recorrido.destino).distinct().all()
-    ciudades_conocidas = set([c[0] for c in ciudades_de_salida] + [c[0] for c in ciudades_de_llegada])
+    # 1. Una sola consulta: todos los horarios que salen de origen o llegan a destino
+    filas = db.execute(
+        _TRAMOS_CONEXION_STMT, {"origen": origen, "destino": destino, "tipo_dia": tipo_dia}
+    ).all()
 
-    posibles_conexiones = [c for c in ciudades_conocidas if c != origen and c != destino]
+    # 2. Agrupar por ciudad de conexión: tramos A (origen -> ciudad) y tramos B (ciudad -> destino).
+    # Los directos origen -> destino no pasan por ninguna ciudad intermedia.
+    tramos_a = defaultdict(list)
+    tramos_b = defaultdict(list)
+    for fila in filas:
+        if fila.origen == origen and fila.destino not in (origen, destino):
+            tramos_a[fila.destino].append(fila)
+        elif fila.destino == destino and fila.origen not in (origen, destino):
+            tramos_b[fila.origen].append(fila)
 
     conexiones_encontradas = []
 
-    for ciudad_conexion in posibles_conexiones:
-        # A. Buscar RECORRIDOS para Tramo A (Origen -> Conexión)
-        recorridos_a = db.query(models.Recorrido).filter(
-            models.Recorrido.origen == origen,
-            models.Recorrido.destino == ciudad_conexion
-        ).all()
-
-        # B. Buscar RECORRIDOS para Tramo B (Conexión -> Destino)
-        recorridos_b = db.query(models.Recorrido).filter(
-            models.Recorrido.origen == ciudad_conexion,
-            models.Recorrido.destino == destino
-        ).all()
+    for ciudad_conexion in sorted(tramos_a.keys() & tramos_b.keys()):
+        horarios_a = tramos_a[ciudad_conexion]
+        horarios_b = tramos_b[ciudad_conexion]
+
+        # 3. Buscar la conexión.
+        # Cada hora se convierte a minutos una sola vez; el resto son comparaciones de enteros.
+        llegadas_a = [time_to_minutes(h.hora_llegada) for h in horarios_a]
+        salidas_b = [time_to_minutes(h.hora_salida) for h in horarios_b]
+
+        # Para cada tramo A, búsqueda binaria sobre las salidas de B (ordenadas):
+        # el primer B con salida > llegada de A es la conexión. O((N + M) log M).
+        for horario_a, llegada_a in zip(horarios_a, llegadas_a):
+            idx = bisect_right(salidas_b, llegada_a)
+            if idx == len(salidas_b):
+                continue
+            horario_b = horarios_b[idx]
+            espera_min = salidas_b[idx] - llegada_a
+
+            # Se encontró una conexión válida (el nombre de cada línea ya vino en la consulta).
+            # Dict con los campos de schemas.Conexion: los valores salen de la base con sus tipos,
+            # no hace falta validarlos con pydantic
+            conexiones_encontradas.append({
+                "tramo_a_salida": horario_a.hora_salida,
+                "tramo_a_llegada": horario_a.hora_llegada,
+                "tramo_b_salida": horario_b.hora_salida,
+                "tramo_b_llegada": horario_b.hora_llegada,
+                "tiempo_espera_min": espera_min,
+                "ciudad_conexion": ciudad_conexion,
+                "linea_a_nombre": horario_a.nombre,
+                "linea_b_nombre": horario_b.nombre
+            })
 
-        # C. Buscar HORARIOS para RECORRIDOS A y RECORRIDOS B, filtrando por tipo_dia
-        horarios_a = db.query(models.Horario).filter(
-            models.Horario.recorrido_id.in_([r.id for r in recorridos_a]),
-            models.Horario.tipo_dia == tipo_dia
-        ).order_by(models.Horario.hora_salida).all()
-
-        horarios_b = db.query(models.Horario).filter(
-            models.Horario.recorrido_id.in_([r.id for r in recorridos_b]),
-            models.Horario.tipo_dia == tipo_dia
-        ).order_by(models.Horario.hora_salida).all()
-        
-        # D. Buscar la conexión y filtrar por hora_actual
-        def str_to_minutos(hora):
-            h, m = map(int, hora.split(":"))
-            return h * 60 + m
-        min_actual = str_to_minutos(hora_actual)
-
-        for horario_a in horarios_a:
-            if str_to_minutos(horario_a.hora_salida) < min_actual:
-                continue  # Saltar horarios antes de hora_actual
-
-            llegada_a = datetime.strptime(horario_a.hora_llegada, FMT)
-
-            for horario_b in horarios_b:
-                try:
-                    salida_b = datetime.strptime(horario_b.hora_salida, FMT)
-                except ValueError:
-                    continue
-
-                # Validar la conexión: salida_b > llegada_a
-                if salida_b > llegada_a:
-                    diferencia = salida_b - llegada_a
-                    espera_min = int(diferencia.total_seconds() / 60)
-
-                    # Se encontró una conexión válida
-                    linea_a_nombre = db.query(models.Linea.nombre).join(models.Recorrido).filter(
-                        models.Recorrido.id == horario_a.recorrido_id
-                    ).scalar()
-                    linea_b_nombre = db.query(models.Linea.nombre).join(models.Recorrido).filter(
-                        models.Recorrido.id == horario_b.recorrido_id
-                    ).scalar()
-
-                    conexion = schemas.Conexion(
-                        tramo_a_salida=horario_a.hora_salida,
-                        tramo_a_llegada=horario_a.hora_llegada,
-                        tramo_b_salida=horario_b.hora_salida,
-                        tramo_b_llegada=horario_b.hora_llegada,
-                        tiempo_espera_min=espera_min,
-                        ciudad_conexion=ciudad_conexion,
-                        linea_a_nombre=linea_a_nombre,
-                        linea_b_nombre=linea_b_nombre
-                    )
-                    conexiones_encontradas.append(conexion)
-                    break
-
-    if not conexiones_encontradas:
-        raise HTTPException(
-            status_code=404,
-            detail="No se encontraron combinaciones de conexiones posibles."
-        )
-    
-    # Ordenar por el tiempo total de viaje
-    conexiones_encontradas.sort(key=lambda c: datetime.strptime(c.tramo_a_salida, FMT))
+    # Ordenar por hora de salida (HH:MM con ceros a la izquierda ordena igual que la hora)
+    conexiones_encontradas.sort(key=lambda c: c["tramo_a_salida"])
+    salidas_min = [time_to_minutes(c["tramo_a_salida"]) for c in conexiones_encontradas]
+    conexiones_json = [to_json(c) for c in conexiones_encontradas]
 
-    return conexiones_encontradas
+    return salidas_min, conexiones_json
 
 
 
@@ -628,13 +1009,13 @@ def calcular_conexiones(
 @app.get('/users/', response_model=List[schemas.UserOut], tags=["Usuarios"], dependencies=[Depends(get_admin_user)])
 def get_usuarios(db: Session = Depends(get_db)):
     """Obtener todos los usuarios (SOLO Administradores autenticados)"""
-    users = db.query(models.User).all()
+    users = db.scalars(select(models.User)).all()
     return users
 
 @app.get('/users/{user_id}', response_model=schemas.UserOut, tags=["Usuarios"], dependencies=[Depends(get_admin_user)])
 def get_usuario(user_id: int, db: Session = Depends(get_db)):
     """Obtener un usuario por id (SOLO Administradores autenticados)"""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     return user
@@ -642,8 +1023,6 @@ def get_usuario(user_id: int, db: Session = Depends(get_db)):
 @app.post('/users/', response_model=schemas.UserOut, status_code=status.HTTP_201_CREATED, tags=["Usuarios"], dependencies=[Depends(get_admin_user)])
 def crear_usuario(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Crear usuario (SOLO Administradores autenticados)"""
-    from auth.auth_utils import hash_password
-    from auth.crud_user import get_user
     existing_user = get_user(db, user.username)
     if existing_user:
         raise HTTPException(status_code=400, detail="El nombre de usuario ya existe")
@@ -657,21 +1036,29 @@ def crear_usuario(user: schemas.UserCreate, db: Session = Depends(get_db)):
 @app.put('/users/{user_id}', response_model=schemas.UserOut, tags=["Usuarios"], dependencies=[Depends(get_admin_user)])
 def update_usuario(user_id: int, user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Actualizar usuario (SOLO Administradores autenticados)"""
-    from auth.auth_utils import hash_password
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not db_user:
+    # El 404 se resuelve antes del hash: un id inexistente no paga bcrypt
+    if db.scalar(select(1).where(models.User.id == user_id)) is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    hashed_password = hash_password(user.userpassword)
+
+    # UPDATE ... RETURNING con solo las columnas de la respuesta (nunca la contraseña)
+    db_user = db.execute(
+        update(models.User).where(models.User.id == user_id)
+        .values(username=user.username, role=user.role, userpassword=hashed_password)
+        .returning(models.User.id, models.User.username, models.User.role)
+    ).mappings().one_or_none()
+    if db_user is None:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    db_user.username = user.username
-    db_user.role = user.role
-    db_user.userpassword = hash_password(user.userpassword)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 @app.delete('/users/{user_id}', status_code=204, tags=["Usuarios"])
-def delete_usuario(user_id: int, db: Session = Depends(get_db), currentUser: models.User = Depends(get_admin_user)):
+def delete_usuario(user_id: int, db: Session = Depends(get_db), currentUser: Row = Depends(get_admin_user)):
     """Eliminar usuario (SOLO Administradores autenticados)"""
-    user_to_delete = db.query(models.User).filter(models.User.id == user_id).first()
+    # Solo las columnas que usan las validaciones; el borrado va directo con DELETE
+    user_to_delete = db.execute(
+        select(models.User.id, models.User.role).where(models.User.id == user_id)
+    ).first()
 
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
@@ -685,8 +1072,11 @@ def delete_usuario(user_id: int, db: Session = Depends(get_db), currentUser: mod
     
     # --- VALIDACIÓN 2: No eliminar al último admin ---
     # Solo nos preocupa si el usuario a eliminar es admin
-    if user_to_delete.role == "admin": # Asegúrate que tu campo se llama 'role' o similar
-        admin_count = db.query(models.User).filter(models.User.role == "admin").count()
+    # role es un RoleEnum: se compara con el miembro, no con el string
+    if user_to_delete.role == models.RoleEnum.admin:
+        admin_count = db.scalar(
+            select(func.count()).select_from(models.User).where(models.User.role == models.RoleEnum.admin)
+        )
 
         if admin_count <= 1:
             raise HTTPException(
@@ -695,7 +1085,7 @@ def delete_usuario(user_id: int, db: Session = Depends(get_db), currentUser: mod
             )
 
     # Si pasa todo, borrar
-    db.delete(user_to_delete)
+    db.execute(delete(models.User).where(models.User.id == user_id))
     db.commit()
     return None
 
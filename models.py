@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Enum, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, Enum, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -20,6 +20,16 @@ class Recorrido(Base):
   linea = relationship("Linea", back_populates="recorridos")
   horarios = relationship("Horario", back_populates="recorrido")
 
+  # (origen, destino): búsquedas de directos y tramos A de conexiones; destino: tramos B
+  # (el OR origen/destino de conexiones necesita un índice por cada lado);
+  # (linea_id, origen, destino): un mismo origen-destino no se repite en una línea (lo valida la base
+  # al escribir) y, por empezar con linea_id, sirve para los recorridos de una línea
+  __table_args__ = (
+    Index("ix_recorrido_origen_destino", "origen", "destino"),
+    Index("ix_recorrido_destino", "destino"),
+    Index("ux_recorrido_linea_origen_destino", "linea_id", "origen", "destino", unique=True),
+  )
+
 class Horario(Base):
   __tablename__ = "horarios"
 
@@ -31,6 +41,12 @@ class Horario(Base):
   recorrido_id = Column(Integer, ForeignKey("recorridos.id"))
   recorrido = relationship("Recorrido", back_populates="horarios")
 
+  # Cubre el filtro (recorrido_id, tipo_dia) + ORDER BY hora_salida de las consultas de horarios.
+  # Único: un recorrido no tiene dos salidas a la misma hora el mismo tipo de día
+  __table_args__ = (
+    Index("ux_horario_rec_dia_salida", "recorrido_id", "tipo_dia", "hora_salida", unique=True),
+  )
+
 class RoleEnum(enum.Enum):
   admin = "Administrador"
   user = "Usuario"
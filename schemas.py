@@ -1,37 +1,33 @@
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List, Literal
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field
+from typing import Annotated, Optional, List, Literal
 from models import RoleEnum
 from utils.validators import password_strength
 
+# HH:MM entre 00:00 y 23:59. [0-9] y no \d: en pydantic-core \d acepta cualquier dígito Unicode
+# y time_to_minutes solo sabe leer dígitos ASCII
+_HHMM = r"^([01][0-9]|2[0-3]):[0-5][0-9]$"
+
 # --- Esquemas para Horarios ---
 class HorarioBase(BaseModel):
   tipo_dia: Literal["habil", "sábado", "domingo"]
-  hora_salida: str = Field(..., pattern=r"^\d{2}:\d{2}$")
-  hora_llegada: str = Field(..., pattern=r"^\d{2}:\d{2}$")
+  hora_salida: str
+  hora_llegada: str
   recorrido_id: int
   directo: bool = False
 
-  @field_validator("hora_salida", "hora_llegada")
-  @classmethod
-  def valid_time(cls, v):
-      try:
-          partes = v.split(":")
-          if len(partes) != 2:
-              raise ValueError()
-          h, m = int(partes[0]), int(partes[1])
-          if not (0 <= h <= 23 and 0 <= m <= 59):
-              raise ValueError()
-      except Exception:
-          raise ValueError("La hora debe estar en formato HH:MM, entre 00:00 y 23:59")
-      return v
-
 class HorarioCreate(HorarioBase):
-  pass
+  # El formato de hora se valida al escribir; las respuestas leen horas que ya pasaron por acá.
+  # El rango completo va en el patrón: lo valida pydantic-core, sin un validador en Python
+  hora_salida: str = Field(..., pattern=_HHMM)
+  hora_llegada: str = Field(..., pattern=_HHMM)
+
+class HorarioBulkCreate(BaseModel):
+    """Request para creación múltiple de horarios"""
+    horarios: List[HorarioCreate] = Field(..., min_length=1, max_length=500)
 
 class Horario(HorarioBase):
   id: int
-  class Config:
-    from_attributes = True
+  model_config = ConfigDict(from_attributes=True)
 
 class HorarioConRecorrido(HorarioBase):
   id: int
@@ -39,8 +35,7 @@ class HorarioConRecorrido(HorarioBase):
   destino:str
   linea_nombre: str
 
-  class Config:
-    from_attributes = True
+  model_config = ConfigDict(from_attributes=True)
 
 # --- Esquemas para Recorridos ---
 class RecorridoBase(BaseModel):
@@ -55,8 +50,7 @@ class Recorrido(RecorridoBase):
   id: int
   linea_nombre: Optional[str] = None
   horarios: List[Horario] = []
-  class Config:
-    from_attributes = True
+  model_config = ConfigDict(from_attributes=True)
 
 class RecorridoInfo(BaseModel):
     """Información básica de recorrido para respuestas de conflicto"""
@@ -80,8 +74,7 @@ class LineaCreate(LineaBase):
 class Linea(LineaBase):
   id: int
   recorridos: List[Recorrido] = []
-  class Config:
-    from_attributes = True
+  model_config = ConfigDict(from_attributes=True)
 
 class DeleteConflictLinea(BaseModel):
     """Respuesta cuando una línea tiene datos asociados"""
@@ -92,7 +85,7 @@ class DeleteConflictLinea(BaseModel):
 
 class BulkDeleteRequest(BaseModel):
     """Request para eliminación múltiple"""
-    ids: List[int] = Field(..., min_items=1, max_items=500)
+    ids: List[int] = Field(..., min_length=1, max_length=500)
 
 # --- Esquema para la Conexión ---
 class Conexion(BaseModel):
@@ -107,20 +100,15 @@ class Conexion(BaseModel):
 
 class UserBase(BaseModel):
   username: str = Field(..., min_length=3, max_length=25)
-  role: Optional[RoleEnum] = RoleEnum.admin
+  role: RoleEnum = RoleEnum.admin
 
 class UserCreate(UserBase):
-  userpassword: str = Field(..., min_length=12)
+  # Validar requisitos de seguridad de la contraseña (después del largo mínimo)
+  userpassword: Annotated[str, Field(min_length=12), AfterValidator(password_strength)]
 
-  @field_validator('userpassword')
-  def validate_password(cls, v):
-    # Validar requisitos de seguridad de la contraseña
-    return password_strength(v)
-  
 class UserOut(UserBase):
   id: int
-  class Config:
-    from_attributes = True
+  model_config = ConfigDict(from_attributes=True)
 
 class UserLogin(BaseModel):
     username: str
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+# La base y la configuración se leen al importar los módulos de la app: se definen antes.
+# Cada corrida usa una base SQLite temporal y bcrypt con costo mínimo
+_TMP = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP}/test.db"
+os.environ.setdefault("SECRET_JWT", "clave-de-prueba-con-al-menos-32-caracteres")
+os.environ["BCRYPT_COST"] = "4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import models
+from auth.crud_user import create_user
+from database import Base, SessionLocal, engine
+
+@pytest.fixture
+def client():
+    # Tablas y cachés limpias en cada test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    main._invalidar_caches()
+    main._respaldo_cache.clear()
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def admin_headers(client):
+    with SessionLocal() as db:
+        create_user(db, "admin", "Admin123", models.RoleEnum.admin)
+    respuesta = client.post("/auth/login", json={"username": "admin", "userpassword": "Admin123"})
+    return {"Authorization": f"Bearer {respuesta.json()['access_token']}"}
+
+@pytest.fixture
+def recorrido(client, admin_headers):
+    linea = client.post("/lineas/", json={"nombre": "Línea 1"}, headers=admin_headers).json()
+    return client.post(
+        "/recorridos/", json={"origen": "Centro", "destino": "Terminal", "linea_id": linea["id"]},
+        headers=admin_headers
+    ).json()
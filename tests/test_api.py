@@ -0,0 +1,103 @@
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+def _horario(recorrido_id, hora_salida="08:00", hora_llegada="09:00"):
+    return {
+        "tipo_dia": "habil",
+        "hora_salida": hora_salida,
+        "hora_llegada": hora_llegada,
+        "recorrido_id": recorrido_id,
+    }
+
+# --- Alta masiva de horarios ---
+
+def test_bulk_crea_horarios(client, admin_headers, recorrido):
+    lote = [_horario(recorrido["id"]), _horario(recorrido["id"], "10:00", "11:00")]
+    respuesta = client.post("/horarios/bulk", json={"horarios": lote}, headers=admin_headers)
+    assert respuesta.status_code == 201
+    assert [h["hora_salida"] for h in respuesta.json()] == ["08:00", "10:00"]
+    assert respuesta.json()[0]["linea_nombre"] == "Línea 1"
+
+def test_bulk_rechaza_duplicado_en_el_lote(client, admin_headers, recorrido):
+    lote = [_horario(recorrido["id"]), _horario(recorrido["id"])]
+    respuesta = client.post("/horarios/bulk", json={"horarios": lote}, headers=admin_headers)
+    assert respuesta.status_code == 400
+    assert client.get(f"/horarios-por-recorrido/{recorrido['id']}?tipo_dia=habil").status_code == 404
+
+def test_bulk_rechaza_duplicado_existente(client, admin_headers, recorrido):
+    client.post("/horarios/", json=_horario(recorrido["id"]), headers=admin_headers)
+    lote = [_horario(recorrido["id"], "10:00", "11:00"), _horario(recorrido["id"])]
+    respuesta = client.post("/horarios/bulk", json={"horarios": lote}, headers=admin_headers)
+    assert respuesta.status_code == 400
+    # Si alguno es inválido no se crea ninguno
+    horarios = client.get(f"/horarios-por-recorrido/{recorrido['id']}?tipo_dia=habil").json()
+    assert [h["hora_salida"] for h in horarios] == ["08:00"]
+
+def test_bulk_rechaza_recorrido_inexistente(client, admin_headers, recorrido):
+    lote = [_horario(recorrido["id"]), _horario(999)]
+    respuesta = client.post("/horarios/bulk", json={"horarios": lote}, headers=admin_headers)
+    assert respuesta.status_code == 404
+    assert respuesta.json()["detail"] == "Recorridos no encontrados: [999]"
+    assert client.get(f"/horarios-por-recorrido/{recorrido['id']}?tipo_dia=habil").status_code == 404
+
+# --- Duplicados validados por los índices únicos ---
+
+def test_recorrido_duplicado(client, admin_headers, recorrido):
+    body = {"origen": "Centro", "destino": "Terminal", "linea_id": recorrido["linea_id"]}
+    respuesta = client.post("/recorridos/", json=body, headers=admin_headers)
+    assert respuesta.status_code == 400
+    assert respuesta.json()["detail"] == "Ya existe un recorrido Centro → Terminal en esta línea"
+
+def test_recorrido_duplicado_al_actualizar(client, admin_headers, recorrido):
+    body = {"origen": "Centro", "destino": "Hospital", "linea_id": recorrido["linea_id"]}
+    otro = client.post("/recorridos/", json=body, headers=admin_headers).json()
+    body["destino"] = "Terminal"
+    respuesta = client.put(f"/recorridos/{otro['id']}", json=body, headers=admin_headers)
+    assert respuesta.status_code == 400
+
+def test_horario_duplicado(client, admin_headers, recorrido):
+    assert client.post("/horarios/", json=_horario(recorrido["id"]), headers=admin_headers).status_code == 201
+    respuesta = client.post("/horarios/", json=_horario(recorrido["id"]), headers=admin_headers)
+    assert respuesta.status_code == 400
+    assert respuesta.json()["detail"] == "Ya existe un horario para este recorrido a las 08:00 en días habil"
+
+def test_horario_duplicado_al_actualizar(client, admin_headers, recorrido):
+    client.post("/horarios/", json=_horario(recorrido["id"]), headers=admin_headers)
+    otro = client.post("/horarios/", json=_horario(recorrido["id"], "10:00", "11:00"), headers=admin_headers).json()
+    respuesta = client.put(f"/horarios/{otro['id']}", json=_horario(recorrido["id"]), headers=admin_headers)
+    assert respuesta.status_code == 400
+
+# --- Caché de respuestas ---
+
+def test_escritura_invalida_la_cache(client, admin_headers, recorrido):
+    url = f"/horarios-por-recorrido/{recorrido['id']}?tipo_dia=habil"
+    client.post("/horarios/", json=_horario(recorrido["id"]), headers=admin_headers)
+    assert [h["hora_salida"] for h in client.get(url).json()] == ["08:00"]
+    client.post("/horarios/", json=_horario(recorrido["id"], "10:00", "11:00"), headers=admin_headers)
+    assert [h["hora_salida"] for h in client.get(url).json()] == ["08:00", "10:00"]
+
+    assert len(client.get("/lineas/").json()) == 1
+    client.post("/lineas/", json={"nombre": "Línea 2"}, headers=admin_headers)
+    assert len(client.get("/lineas/").json()) == 2
+
+def test_respaldo_obsoleto_si_falla_la_base(client, admin_headers, recorrido, monkeypatch):
+    anterior = client.get("/lineas/").json()
+    # La escritura vacía la caché; el respaldo conserva la última respuesta buena
+    client.post("/lineas/", json={"nombre": "Línea 2"}, headers=admin_headers)
+
+    def base_caida(*args, **kwargs):
+        raise OperationalError("SELECT", {}, Exception("base caída"))
+    monkeypatch.setattr(Session, "scalars", base_caida)
+
+    respuesta = client.get("/lineas/")
+    assert respuesta.status_code == 200
+    assert respuesta.headers["X-Cache"] == "STALE"
+    assert respuesta.json() == anterior
+
+def test_sin_respaldo_la_falla_se_propaga(client, monkeypatch):
+    def base_caida(*args, **kwargs):
+        raise OperationalError("SELECT", {}, Exception("base caída"))
+    monkeypatch.setattr(Session, "scalars", base_caida)
+
+    client_sin_excepciones = client.__class__(client.app, raise_server_exceptions=False)
+    assert client_sin_excepciones.get("/lineas/").status_code == 500
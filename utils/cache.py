@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """
+    Caché LRU en memoria con vencimiento por entrada.
+    Es segura entre threads (los endpoints sync corren en el threadpool).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if time.time() >= expires_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float = None):
+        """Guarda un valor. expires_at (epoch) no puede superar el TTL de la caché."""
+        limite = time.time() + self.ttl
+        if expires_at is None or expires_at > limite:
+            expires_at = limite
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,19 @@
+import hashlib
+from fastapi import Request, Response
+
+def etag_json_response(request: Request, body: bytes, max_age: int = 60) -> Response:
+    """
+    Arma una respuesta JSON con ETag (hash del contenido) y Cache-Control.
+    Si el cliente ya tiene esa versión (If-None-Match), devuelve 304 sin cuerpo.
+    """
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Comparación débil: se ignora el prefijo W/ que agregan algunos proxies
+        etags_cliente = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+        if etag in etags_cliente or "*" in etags_cliente:
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,27 +1,53 @@
+import functools
 import re
+import string
 from fastapi import HTTPException
 
+# Caracteres requeridos en una contraseña (solo ASCII, igual que las clases [A-Z], [a-z], [0-9]).
+# isdisjoint recorre la contraseña en C, sin pasar por el motor de regex
+_MAYUSCULAS = frozenset(string.ascii_uppercase)
+_MINUSCULAS = frozenset(string.ascii_lowercase)
+_DIGITOS = frozenset(string.digits)
+
 def password_strength(password: str) -> str:
     """Valida que la contraseña cumpla con los requisitos mínimos de seguridad."""
-    if not re.search(r"[A-Z]", password):
+    if _MAYUSCULAS.isdisjoint(password):
         raise ValueError("La contraseña debe contener al menos una letra mayúscula.")
-    if not re.search(r"[a-z]", password):
+    if _MINUSCULAS.isdisjoint(password):
         raise ValueError("La contraseña debe contener al menos una letra minúscula.")
-    if not re.search(r"[0-9]", password):
+    if _DIGITOS.isdisjoint(password):
         raise ValueError("La contraseña debe contener al menos un número.")
     return password
 
 def validar_hora(hora: str):
-    if not re.match(r"^\d{2}:\d{2}$", hora):
+    # Formato fijo de 5 caracteres: se revisa por posición, sin regex.
+    # isascii descarta los dígitos Unicode que isdecimal también acepta
+    if not (len(hora) == 5 and hora.isascii() and hora[2] == ":" and hora[:2].isdecimal() and hora[3:].isdecimal()):
         raise ValueError("El formato de hora debe ser HH:MM")
     return True
 
 # ==================== NUEVAS VALIDACIONES ====================
 
+# Hay solo 1440 horas posibles: después de la primera vez, cada conversión es una búsqueda en la caché
+@functools.lru_cache(maxsize=2048)
 def time_to_minutes(time_str: str) -> int:
     """Convierte hora HH:MM a minutos desde medianoche"""
-    h, m = map(int, time_str.split(":"))
-    return h * 60 + m
+    # Las horas guardadas ya pasaron por la validación HH:MM (dos dígitos ASCII cada parte):
+    # cada dígito se lee por posición, sin crear substrings
+    return (
+        (ord(time_str[0]) - 48) * 600 + (ord(time_str[1]) - 48) * 60
+        + (ord(time_str[3]) - 48) * 10 + (ord(time_str[4]) - 48)
+    )
+
+# Hora de consulta (hora_actual): acepta uno o dos dígitos (9:00 o 09:00)
+_HORA_ACTUAL = re.compile(r"([01]?[0-9]|2[0-3]):([0-5]?[0-9])")
+
+def parse_hora_actual(hora_actual: str) -> int:
+    """Valida la hora de consulta y la devuelve en minutos desde medianoche."""
+    match = _HORA_ACTUAL.fullmatch(hora_actual)
+    if not match:
+        raise HTTPException(status_code=400, detail="hora_actual debe ser HH:MM entre 00:00 y 23:59")
+    return int(match[1]) * 60 + int(match[2])
 
 def calculate_trip_duration(hora_salida: str, hora_llegada: str) -> int:
     """
@@ -43,6 +69,10 @@ def validate_horario_duration(hora_salida: str, hora_llegada: str) -> None:
     Lanza HTTPException si es inválida.
     """
     duracion = calculate_trip_duration(hora_salida, hora_llegada)
+
+    # Caso común: una sola comparación encadenada; los mensajes solo se arman si falla
+    if 5 <= duracion <= 600:
+        return
     
     # Duración mínima: 5 minutos
     if duracion < 5:
@@ -52,36 +82,40 @@ def validate_horario_duration(hora_salida: str, hora_llegada: str) -> None:
         )
     
     # Duración máxima: 10 horas (600 minutos)
-    if duracion > 600:
-        raise HTTPException(
-            status_code=400,
-            detail="El viaje no puede durar más de 10 horas"
-        )
+    raise HTTPException(
+        status_code=400,
+        detail="El viaje no puede durar más de 10 horas"
+    )
 
-def validate_recorrido_unique(db, origen: str, destino: str, linea_id: int, exclude_id: int = None):
+def recorrido_duplicado(origen: str, destino: str) -> HTTPException:
     """
-    Valida que no exista un recorrido duplicado EN LA MISMA LÍNEA.
+    Error para un recorrido repetido EN LA MISMA LÍNEA.
     Dos líneas diferentes SÍ pueden tener el mismo origen-destino.
-    exclude_id se usa al actualizar para excluir el registro actual.
+    La unicidad la valida la base (índice único linea_id, origen, destino): los endpoints
+    levantan este error cuando la escritura falla con IntegrityError.
     """
+    return HTTPException(
+        status_code=400,
+        detail=f"Ya existe un recorrido {origen} → {destino} en esta línea"
+    )
+
+def validate_recorrido_unique(db, origen: str, destino: str, linea_id: int, exclude_id: int = None):
+    """
+    Consulta previa de duplicados, solo para bases donde init_db no pudo crear el índice único
+    (tienen recorridos repetidos de antes). exclude_id se usa al actualizar para excluir el registro actual.
+    """
+    from sqlalchemy import select
     from models import Recorrido
-    
-    query = db.query(Recorrido).filter(
+
+    query = select(1).where(
         Recorrido.origen == origen,
         Recorrido.destino == destino,
-        Recorrido.linea_id == linea_id  # CLAVE: Solo validar en la misma línea
+        Recorrido.linea_id == linea_id
     )
-    
     if exclude_id:
-        query = query.filter(Recorrido.id != exclude_id)
-    
-    existing = query.first()
-    
-    if existing:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Ya existe un recorrido {origen} → {destino} en esta línea"
-        )
+        query = query.where(Recorrido.id != exclude_id)
+    if db.scalar(query.limit(1)) is not None:
+        raise recorrido_duplicado(origen, destino)
 
 def validate_origen_destino_different(origen: str, destino: str) -> None:
     """Valida que origen y destino sean diferentes"""
@@ -91,41 +125,49 @@ def validate_origen_destino_different(origen: str, destino: str) -> None:
             detail="El origen y destino no pueden ser iguales"
         )
 
-def validate_horario_unique(db, recorrido_id: int, tipo_dia: str, hora_salida: str, exclude_id: int = None):
+def horario_duplicado(tipo_dia: str, hora_salida: str) -> HTTPException:
     """
-    Valida que no exista un horario duplicado EN EL MISMO RECORRIDO.
+    Error para un horario repetido EN EL MISMO RECORRIDO.
     - Mismo recorrido + mismo tipo_dia + misma hora_salida = DUPLICADO
     - Diferentes recorridos pueden tener la misma hora (aunque sean de la misma línea)
+    La unicidad la valida la base (índice único recorrido_id, tipo_dia, hora_salida).
+    """
+    return HTTPException(
+        status_code=400,
+        detail=f"Ya existe un horario para este recorrido a las {hora_salida} en días {tipo_dia}"
+    )
+
+def validate_horario_unique(db, recorrido_id: int, tipo_dia: str, hora_salida: str, exclude_id: int = None):
     """
+    Consulta previa de duplicados, solo para bases donde init_db no pudo crear el índice único
+    (tienen horarios repetidos de antes). exclude_id se usa al actualizar para excluir el registro actual.
+    """
+    from sqlalchemy import select
     from models import Horario
-    
-    query = db.query(Horario).filter(
-        Horario.recorrido_id == recorrido_id,  # CLAVE: Solo validar en el mismo recorrido
+
+    query = select(1).where(
+        Horario.recorrido_id == recorrido_id,
         Horario.tipo_dia == tipo_dia,
         Horario.hora_salida == hora_salida
     )
-    
     if exclude_id:
-        query = query.filter(Horario.id != exclude_id)
-    
-    existing = query.first()
-    
-    if existing:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Ya existe un horario para este recorrido a las {hora_salida} en días {tipo_dia}"
-        )
+        query = query.where(Horario.id != exclude_id)
+    if db.scalar(query.limit(1)) is not None:
+        raise horario_duplicado(tipo_dia, hora_salida)
 
 def validate_linea_nombre(nombre: str) -> None:
     """Valida el nombre de una línea"""
+    # Caso común: nombre válido en una sola condición
+    if len(nombre) <= 50 and len(nombre.strip()) >= 2:
+        return
+
     if not nombre or len(nombre.strip()) < 2:
         raise HTTPException(
             status_code=400,
             detail="El nombre de la línea debe tener al menos 2 caracteres"
         )
     
-    if len(nombre) > 50:
-        raise HTTPException(
-            status_code=400,
-            detail="El nombre de la línea no puede exceder 50 caracteres"
-        )
\ No newline at end of file
+    raise HTTPException(
+        status_code=400,
+        detail="El nombre de la línea no puede exceder 50 caracteres"
+    )
\ No newline at end of file